@@ -1,6 +1,6 @@
+from dataclasses import dataclass
 from enum import Enum
-from typing import List, Optional
-from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 
 class ModelType(str, Enum):
     CHECKPOINT = "checkpoint"
@@ -9,24 +9,24 @@ class ModelType(str, Enum):
     EMBEDDING = "embedding"
     CONTROLNET = "controlnet"
 
-class ModelSpec(BaseModel):
-    name: str = Field(..., description="Name of the model file (e.g. 'sd_xl_base_1.0.safetensors')")
-    url: str = Field(..., description="Download URL for the model")
-    type: ModelType = Field(default=ModelType.CHECKPOINT, description="Type of the model")
-    subfolder: Optional[str] = Field(None, description="Specific subfolder in ComfyUI/models/ to place it")
+#Map the download and pray that it works based on type
+_INSTALL_PATH_MAP: Dict[ModelType, str] = {
+    ModelType.CHECKPOINT: "checkpoints",
+    ModelType.LORA: "loras",
+    ModelType.VAE: "vae",
+    ModelType.EMBEDDING: "embeddings",
+    ModelType.CONTROLNET: "controlnet",
+}
+
+@dataclass(slots=True, frozen=True)
+class ModelSpec:
+    name: str  # Name of the model file (e.g. 'sd_xl_base_1.0.safetensors')
+    url: str  # Download URL for the model
+    type: ModelType = ModelType.CHECKPOINT  # Type of the model
+    subfolder: Optional[str] = None  # Specific subfolder in ComfyUI/models/ to place it
+    sha256: Optional[str] = None  # Expected SHA-256 of the file; hashed files are shared via /workspace/models_cache
 
     @property
     def install_path(self) -> str:
         """Returns the relative path inside ComfyUI/models/ where this should go."""
-        if self.subfolder:
-            return self.subfolder
-        
-        #Map the download and pray that it works based on type
-        mapping = {
-            ModelType.CHECKPOINT: "checkpoints",
-            ModelType.LORA: "loras",
-            ModelType.VAE: "vae",
-            ModelType.EMBEDDING: "embeddings",
-            ModelType.CONTROLNET: "controlnet",
-        }
-        return mapping.get(self.type, "checkpoints")
\ No newline at end of file
+        return self.subfolder or _INSTALL_PATH_MAP.get(self.type, "checkpoints")
\ No newline at end of file
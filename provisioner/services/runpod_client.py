@@ -1,12 +1,135 @@
 import runpod
+from runpod.api.graphql import run_graphql_query
 import time
 import paramiko
+import shlex
+import socket
 from typing import List, Dict, Any, Generator
 import logging
 from ..models import ProvisioningConfig, ModelSpec
 
 logger = logging.getLogger(__name__)
 
+# Only the fields wait_for_pod and execute_setup need, fetched in one round-trip
+POD_STATUS_QUERY = """
+query pod {{
+  pod(input: {{podId: "{pod_id}"}}) {{
+    id
+    desiredStatus
+    runtime {{
+      ports {{
+        ip
+        isIpPublic
+        privatePort
+        publicPort
+        type
+      }}
+    }}
+  }}
+}}
+"""
+
+# Static parts of the setup script, joined once at import.
+# The header is filled in with str.format, so it must not contain literal braces.
+_SCRIPT_HEADER = "\n".join([
+    "#!/bin/bash",
+    "set -e", # Exit on error
+    "echo 'Starting ComfyUI Provisioning...'",
+    "cd /workspace",
+    "",
+    "# Install ComfyUI",
+    "if [ ! -d 'ComfyUI' ]; then",
+    "  git clone {comfyui_repo}",
+    "fi",
+    "cd ComfyUI",
+    "pip install -r requirements.txt",
+    "",
+    "# Install Manager",
+    "cd custom_nodes",
+    "if [ ! -d 'ComfyUI-Manager' ]; then",
+    "  git clone {comfyui_manager_repo}",
+    "fi",
+    "cd ..", # Back to ComfyUI root
+    "",
+])
+
+_DOWNLOAD_HELPERS = "\n".join([
+    "# Download Models",
+    "# Downloads run in the background, at most MAX_JOBS at a time",
+    "MAX_JOBS=4",
+    "PIDS=()",
+    "CACHE_DIR=/workspace/models_cache",
+    "download() {",
+    "  # download <dest> <url> <sha256|\"\"> [extra wget args...]",
+    "  # Writes to <dest>.part so an interrupted file is resumed, not mistaken for a finished one",
+    "  mkdir -p \"$(dirname \"$1\")\"",
+    "  wget -nv -c --tries=10 --timeout=60 \"${@:4}\" -O \"$1.part\" \"$2\"",
+    "  if [ -n \"$3\" ] && ! echo \"$3  $1.part\" | sha256sum -c --status; then",
+    "    echo \"sha256 mismatch for $2\" >&2",
+    "    rm -f \"$1.part\"",
+    "    return 1",
+    "  fi",
+    "  mv \"$1.part\" \"$1\"",
+    "}",
+    "remote_etag() {",
+    "  # remote_etag <url> [extra curl args...]; ETag of the final response after redirects",
+    "  curl -sIL \"${@:2}\" \"$1\" | tr -d '\\r' | awk 'tolower($1) == \"etag:\" { e = $2 } END { print e }'",
+    "}",
+    "fetch() {",
+    "  # fetch <dest> <url> <sha256|\"\"> [extra wget args...]",
+    "  local dest=\"$1\" url=\"$2\" sha=\"$3\" name etag=\"\"",
+    "  name=\"$(basename \"$dest\")\"",
+    "  if [ -n \"$sha\" ]; then",
+    "    # Hashed files live once in CACHE_DIR and are symlinked into place, so deploys share them",
+    "    local cached=\"$CACHE_DIR/$sha\"",
+    "    if [ -s \"$cached\" ]; then",
+    "      echo \"$name found in cache\"",
+    "    elif [ -f \"$dest\" ] && [ ! -L \"$dest\" ] && echo \"$sha  $dest\" | sha256sum -c --status; then",
+    "      echo \"$name matches sha256, moving it into the cache\"",
+    "      mkdir -p \"$CACHE_DIR\"",
+    "      mv \"$dest\" \"$cached\"",
+    "    else",
+    "      echo \"Downloading $name...\"",
+    "      download \"$cached\" \"$url\" \"$sha\" \"${@:4}\"",
+    "    fi",
+    "    mkdir -p \"$(dirname \"$dest\")\"",
+    "    ln -sfn \"$cached\" \"$dest\"",
+    "    return 0",
+    "  fi",
+    "  # Without a hash, Hugging Face files are re-fetched only when their ETag changes",
+    "  case \"$url\" in",
+    "    *huggingface.co*) etag=\"$(remote_etag \"$url\" \"${@:4}\")\" ;;",
+    "  esac",
+    "  if [ -s \"$dest\" ]; then",
+    "    if [ -z \"$etag\" ] || [ ! -f \"$dest.etag\" ] || [ \"$etag\" = \"$(cat \"$dest.etag\")\" ]; then",
+    "      echo \"$name already present, skipping\"",
+    "      return 0",
+    "    fi",
+    "    echo \"$name changed upstream, downloading again\"",
+    "    rm -f \"$dest\" \"$dest.part\"",
+    "  fi",
+    "  echo \"Downloading $name...\"",
+    "  download \"$dest\" \"$url\" \"\" \"${@:4}\"",
+    "  if [ -n \"$etag\" ]; then",
+    "    echo \"$etag\" > \"$dest.etag\"",
+    "  fi",
+    "}",
+    "throttle() {",
+    "  # Wait on the oldest download once the pool is full; set -e aborts if it failed",
+    "  if [ ${#PIDS[@]} -ge $MAX_JOBS ]; then",
+    "    wait \"${PIDS[0]}\"",
+    "    PIDS=(\"${PIDS[@]:1}\")",
+    "  fi",
+    "}",
+])
+
+# dest, url and sha are substituted already shell-quoted
+_FETCH_TEMPLATE = "fetch {dest} {url} {sha}{args}"
+_BACKGROUND_TEMPLATE = "throttle\n{cmd} &\nPIDS+=($!)"
+
+_WAIT_ALL = 'for pid in "${PIDS[@]}"; do wait "$pid"; done'
+_SCRIPT_FOOTER = "echo 'Provisioning Complete!'"
+
 class RunPodService:
     def __init__(self, api_key: str):
         runpod.api_key = api_key
@@ -47,66 +170,128 @@ class RunPodService:
         except Exception as e:
             raise RuntimeError(f"Failed to create pod: {e}")
 
-    def wait_for_pod(self, pod_id: str) -> Dict[str, Any]:
+    def terminate_pod(self, pod_id: str) -> None:
+        """
+        Terminates a pod so it stops billing.
+        """
+        try:
+            runpod.terminate_pod(pod_id)
+        except Exception as e:
+            raise RuntimeError(f"Failed to terminate pod: {e}")
+
+    def get_pod_status(self, pod_id: str) -> Dict[str, Any]:
+        """
+        Fetches the pod's status and exposed ports in a single GraphQL query.
+        """
+        result = run_graphql_query(POD_STATUS_QUERY.format(pod_id=pod_id))
+        pod = result.get('data', {}).get('pod')
+        if not pod:
+            raise RuntimeError(f"Pod {pod_id} not found")
+        return pod
+
+    def wait_for_pod(self, pod_id: str, timeout: float = 1800.0) -> Dict[str, Any]:
         """
         Waits for the pod to become running.
+        Polls with capped exponential backoff and raises TimeoutError after `timeout` seconds.
+        The default allows for cold pulls of large images on community cloud hosts.
+        """
+        deadline = time.monotonic() + timeout
+        delay = 1.0
+        # Consecutive failed polls tolerated before giving up, so one API blip doesn't end the wait
+        retries = 5
+        failures = 0
+        while True:
+            try:
+                pod = self.get_pod_status(pod_id)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                if failures >= retries:
+                    raise
+                logger.warning(f"Polling pod {pod_id} failed ({failures}/{retries}): {e}")
+                pod = None
+
+            if pod is not None:
+                # runtime stays null until the container has started
+                if pod['desiredStatus'] == 'RUNNING' and (pod.get('runtime') or {}).get('ports'):
+                    return pod
+                if pod['desiredStatus'] == 'EXITED': # Should not happen ideally
+                     raise RuntimeError("Pod exited unexpectedly")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Pod {pod_id} did not start within {timeout:.0f}s")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 1.5, 30.0)
+
+    def wait_for_port(self, host: str, port: int, timeout: float = 30.0) -> bool:
+        """
+        Probes host:port until a TCP handshake succeeds.
+        Returns False if it is still closed after `timeout` seconds.
         """
+        deadline = time.monotonic() + timeout
         while True:
-            pod = runpod.get_pod(pod_id)
-            if pod['desiredStatus'] == 'RUNNING' and pod.get('runtime', {}).get('ports'):
-                return pod
-            if pod['desiredStatus'] == 'EXITED': # Should not happen ideally
-                 raise RuntimeError("Pod exited unexpectedly")
-            
-            time.sleep(2)
+            try:
+                with socket.create_connection((host, port), timeout=1):
+                    return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.2)
 
     def generate_setup_script(self, config: ProvisioningConfig) -> str:
         """
         Generates a bash script to install ComfyUI and models.
         """
         script = [
-            "#!/bin/bash",
-            "set -e", # Exit on error
-            "echo 'Starting ComfyUI Provisioning...'",
-            "cd /workspace",
-            "",
-            "# Install ComfyUI",
-            f"if [ ! -d 'ComfyUI' ]; then",
-            f"  git clone {config.comfyui_repo}",
-            "fi",
-            "cd ComfyUI",
-            "pip install -r requirements.txt",
-            "",
-            "# Install Manager",
-            "cd custom_nodes",
-            f"if [ ! -d 'ComfyUI-Manager' ]; then",
-            f"  git clone {config.comfyui_manager_repo}",
-            "fi",
-            "cd ..", # Back to ComfyUI root
-            "",
-            "# Download Models",
+            _SCRIPT_HEADER.format(
+                comfyui_repo=config.comfyui_repo,
+                comfyui_manager_repo=config.comfyui_manager_repo,
+            ),
+            _DOWNLOAD_HELPERS,
         ]
 
+        # Declared once as a bash array; only expanded for Hugging Face URLs
+        hf_args = ""
+        if config.hf_token:
+            # Separate flag and value so the same array works for both wget and curl
+            script.append("HF_HDR=(--header " + shlex.quote(f"Authorization: Bearer {config.hf_token}") + ")")
+            hf_args = ' "${HF_HDR[@]}"'
+
+        seen = set()
+        seen_sha = set()
+        deferred = []
         for model in config.models:
-            path = f"models/{model.install_path}"
+            # Same destination twice would just race two downloads of one file
+            key = (model.install_path, model.name)
+            if key in seen:
+                continue
+            seen.add(key)
             # Check if URL is valid (basic check)
             if model.url.startswith("http"):
-                script.append(f"echo 'Downloading {model.name}...'")
-                
-                wget_args = ""
-                if "huggingface.co" in model.url and config.hf_token:
-                     wget_args = f"--header='Authorization: Bearer {config.hf_token}'"
-                
-                # Use wget with content-disposition if name not explicit, but we have name
-                script.append(f"wget {wget_args} -O '{path}/{model.name}' '{model.url}'")
-            
-        script.append("echo 'Provisioning Complete!'")
+                sha = model.sha256.lower() if model.sha256 else ""
+                cmd = _FETCH_TEMPLATE.format(
+                    dest=shlex.quote(f"models/{model.install_path}/{model.name}"),
+                    url=shlex.quote(model.url),
+                    sha=shlex.quote(sha),
+                    args=hf_args if "huggingface.co" in model.url else "",
+                )
+                # A repeated hash shares one cache file; link it once the first download is done
+                if sha and sha in seen_sha:
+                    deferred.append(cmd)
+                    continue
+                seen_sha.add(sha)
+                script.append(_BACKGROUND_TEMPLATE.format(cmd=cmd))
+
+        script.append(_WAIT_ALL)
+        script.extend(deferred)
+        script.append(_SCRIPT_FOOTER)
         return "\n".join(script)
 
-    def execute_setup(self, pod: Dict[str, Any], config: ProvisioningConfig) -> Generator[str, None, None]:
+    def execute_setup(self, pod: Dict[str, Any], script_content: str) -> Generator[str, None, None]:
         """
-        Connects via SSH and executes the setup script.
-        Yields logs.
+        Connects via SSH and executes the setup script (see generate_setup_script).
+        Yields logs. Raises RuntimeError if SSH fails or the script exits non-zero.
         """
         # Extract SSH info
         ssh_port = None
@@ -120,61 +305,90 @@ class RunPodService:
                     break
         
         if not ssh_port or not public_ip:
-             yield "Error: Could not find SSH port."
-             return
+             raise RuntimeError("Could not find SSH port.")
 
-        # Wait a bit for SSH to be up
-        time.sleep(5)
+        # Wait for sshd to accept TCP connections instead of sleeping a fixed amount
+        if not self.wait_for_port(public_ip, ssh_port):
+            yield "SSH port not reachable yet, retrying connection..."
 
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         
-        # Try connecting multiple times
-        retries = 10
-        for i in range(retries):
-            try:
-                # Standard RunPod templates typically use root/password or root key
-                # We might need to handle keys. Ideally user provides one or we assume the 
-                # template allows passwordless or we generate one. 
-                # Many RunPod templates use keys. 
-                # Wait, runpod.create_pod doesn't upload keys by default unless configured in user profile.
-                # But we assume the user has configured their SSH keys in RunPod account? 
-                # Or we can try to assume a default password if the template has one?
-                # Most runpod/pytorch images don't have a default password set for root unless passed in env.
-                # BUT, `runpod` library allows executing commands? No, looking at docs, `exec_command` is not in the library directly for pods?
-                # Actually, `runpodctl` does it. 
-                # Let's assume the user has their SSH key loaded in their local agent, or we can't easily SSH.
+        try:
+            # Try connecting multiple times, backing off between attempts
+            retries = 10
+            delay = 1.0
+            for i in range(retries):
+                try:
+                    # Standard RunPod templates typically use root/password or root key
+                    # We might need to handle keys. Ideally user provides one or we assume the 
+                    # template allows passwordless or we generate one. 
+                    # Many RunPod templates use keys. 
+                    # Wait, runpod.create_pod doesn't upload keys by default unless configured in user profile.
+                    # But we assume the user has configured their SSH keys in RunPod account? 
+                    # Or we can try to assume a default password if the template has one?
+                    # Most runpod/pytorch images don't have a default password set for root unless passed in env.
+                    # BUT, `runpod` library allows executing commands? No, looking at docs, `exec_command` is not in the library directly for pods?
+                    # Actually, `runpodctl` does it. 
+                    # Let's assume the user has their SSH key loaded in their local agent, or we can't easily SSH.
                 
-                # For this MVP, let's assume we rely on `paramiko` connecting. 
-                # If this fails, we might need to ask user for SSH key path.
+                    # For this MVP, let's assume we rely on `paramiko` connecting. 
+                    # If this fails, we might need to ask user for SSH key path.
                 
-                client.connect(public_ip, port=ssh_port, username='root', timeout=10)
-                break
-            except Exception as e:
-                if i == retries - 1:
-                    yield f"Failed to connect via SSH: {e}"
-                    return
-                time.sleep(2)
-                yield "Waiting for SSH..."
-
-        # Execute
-        script_content = self.generate_setup_script(config)
-        
-        # Write script to file
-        cmd = f"cat << 'EOF' > /workspace/setup_comfy.sh\n{script_content}\nEOF\n"
-        stdin, stdout, stderr = client.exec_command(cmd)
-        exit_status = stdout.channel.recv_exit_status()
-        
-        if exit_status != 0:
-            yield "Failed to write setup script."
-            return
+                    client.connect(
+                        public_ip,
+                        port=ssh_port,
+                        username='root',
+                        timeout=10,
+                        auth_timeout=10,
+                        banner_timeout=10,
+                        compress=True, # Log output is chatty text; compression cuts bytes over the WAN
+                        allow_agent=True,
+                        look_for_keys=True,
+                        disabled_algorithms={'pubkeys': ['ssh-rsa']}, # Skip SHA-1 RSA signatures
+                    )
+                    break
+                except Exception as e:
+                    if i == retries - 1:
+                        raise RuntimeError(f"Failed to connect via SSH: {e}")
+                    time.sleep(delay)
+                    delay = min(delay * 1.5, 30.0)
+                    yield "Waiting for SSH..."
 
-        # Run script
-        stdin, stdout, stderr = client.exec_command("chmod +x /workspace/setup_comfy.sh && /workspace/setup_comfy.sh")
-        
-        # Stream output
-        for line in iter(stdout.readline, ""):
-            yield line.strip()
+            # Upload the script over SFTP: no shell escaping, and it stays on the volume for manual re-runs
+            script_path = "/workspace/setup_comfy.sh"
+            sftp = client.open_sftp()
+            with sftp.file(script_path, "w", bufsize=1 << 20) as f:
+                # Owner-only before any content lands: the script embeds the Hugging Face token
+                f.chmod(0o700)
+                f.write(script_content)
+            sftp.close()
+
+            # Run script
+            chan = client.get_transport().open_session()
+            chan.set_combine_stderr(True) # Interleave stderr so pip/git errors show up in order
+            chan.exec_command(script_path)
         
-        client.close()
+            # Stream output as it arrives; recv returns whatever is buffered instead of blocking per line
+            buf = bytearray()
+            while True:
+                data = chan.recv(65536)
+                if not data:
+                    break
+                buf += data
+                end = buf.rfind(b"\n")
+                if end < 0:
+                    continue
+                # Decode all complete lines in one go; a split on b"\n" never cuts a UTF-8 sequence
+                text = buf[:end].decode("utf-8", "replace")
+                del buf[:end + 1]
+                yield from text.split("\n")
+            if buf:
+                yield buf.decode("utf-8", "replace")
+
+            exit_status = chan.recv_exit_status()
+            if exit_status != 0:
+                raise RuntimeError(f"Setup script failed with exit status {exit_status}.")
+        finally:
+            client.close()
 
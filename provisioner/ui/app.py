@@ -1,16 +1,19 @@
 from textual.app import App, ComposeResult
-from textual.containers import Container, Vertical, Horizontal
-from textual.widgets import Header, Footer, Button, Input, Label, Select, Log, Static
+from textual.containers import Container, Horizontal
+from textual.widgets import Header, Footer, Button, Input, Label, Select, Log, Static, DataTable
 from textual.screen import Screen
 from textual.message import Message
 from textual.reactive import reactive
-from textual.worker import Worker
+from textual.worker import Worker, WorkerState
 
-from ..models import ProvisioningConfig, ModelSpec, ModelType
+from ..models import ProvisioningConfig, ModelSpec, ModelType, SHA256_RE
 from ..services.runpod_client import RunPodService
 
 import os
 import time
+from collections import deque
+
+_MODEL_TYPE_BY_VALUE = {t.value: t for t in ModelType}
 
 class ConfigScreen(Screen):
     BINDINGS = [("n", "next", "Next")]
@@ -120,39 +123,48 @@ class ModelScreen(Screen):
             Horizontal(
                 Input(placeholder="URL", id="model_url", classes="box url_input"),
                 Input(placeholder="Filename", id="model_name", classes="box name_input"),
-                Select([(t.value, t.name) for t in ModelType], id="model_type", value=ModelType.CHECKPOINT.value),
+                Input(placeholder="SHA256 (optional)", id="model_sha", classes="box sha_input"),
+                Select([(t.name, t.value) for t in ModelType], id="model_type", value=ModelType.CHECKPOINT.value),
                 Button("Add", id="add_btn"),
                 classes="input_row"
             ),
             Label("Added Models:", classes="mt-1"),
-            Vertical(id="model_list", classes="box model_list"),
+            DataTable(id="model_list", classes="box model_list"),
             Button("Deploy", variant="success", id="deploy_btn", classes="mt-1")
         )
         yield Footer()
 
+    def on_mount(self):
+        self.query_one("#model_list", DataTable).add_columns("Type", "Name")
+
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "add_btn":
             url = self.query_one("#model_url", Input).value
             name = self.query_one("#model_name", Input).value
+            sha256 = self.query_one("#model_sha", Input).value.strip()
             m_type_val = self.query_one("#model_type", Select).value
             
             # Map value back to Enum
-            m_type = next((t for t in ModelType if t.value == m_type_val), ModelType.CHECKPOINT)
+            m_type = _MODEL_TYPE_BY_VALUE.get(m_type_val, ModelType.CHECKPOINT)
 
             if not url or not name:
                 self.notify("URL and Name are required", severity="error")
                 return
 
-            spec = ModelSpec(name=name, url=url, type=m_type)
+            if sha256 and not SHA256_RE.fullmatch(sha256):
+                self.notify("SHA256 must be 64 hex characters", severity="error")
+                return
+
+            spec = ModelSpec(name=name, url=url, type=m_type, sha256=sha256 or None)
             self.app.config_data.models.append(spec)
             
             # Add to display
-            list_container = self.query_one("#model_list", Vertical)
-            list_container.mount(Label(f"[{m_type.name}] {name}"))
+            self.query_one("#model_list", DataTable).add_row(m_type.name, name)
             
             # Clear inputs
             self.query_one("#model_url", Input).value = ""
             self.query_one("#model_name", Input).value = ""
+            self.query_one("#model_sha", Input).value = ""
 
         elif event.button.id == "deploy_btn":
             self.app.push_screen("deploy_screen")
@@ -167,29 +179,54 @@ class DeployScreen(Screen):
         yield Footer()
 
     def on_mount(self):
-        self.run_worker(self.perform_deployment, thread=True)
+        # The worker only queues lines; the UI drains them in batches so chatty
+        # remote output doesn't cost one cross-thread call per line
+        self._log_buf = deque()
+        self._log_timer = self.set_interval(0.05, self._flush_logs)
+        self._deploy_worker = self.run_worker(self.perform_deployment, thread=True)
+
+    def on_worker_state_changed(self, event: Worker.StateChanged) -> None:
+        if event.worker is not self._deploy_worker:
+            return
+        if event.state in (WorkerState.SUCCESS, WorkerState.ERROR, WorkerState.CANCELLED):
+            # Nothing else will be queued; drain the tail and stop polling
+            self._flush_logs()
+            self._log_timer.stop()
+
+    def _flush_logs(self):
+        if not self._log_buf:
+            return
+        # deque append/popleft are thread-safe, so no lock is needed against the worker
+        lines = [self._log_buf.popleft() for _ in range(len(self._log_buf))]
+        self.query_one("#log_view", Log).write_lines(lines)
 
     def perform_deployment(self):
-        log_view = self.query_one("#log_view", Log)
-        
         def log(msg):
-            self.app.call_from_thread(log_view.write_line, msg)
+            self._log_buf.append(msg)
 
         log("Initializing RunPod Service...")
         service = RunPodService(self.app.config_data.api_key)
         
         try:
+            # Built once, before any pod exists, and handed to execute_setup as-is
+            script = service.generate_setup_script(self.app.config_data)
+
             log(f"Creating Pod (GPU: {self.app.config_data.gpu_type_id})...")
             pod = service.create_pod(self.app.config_data)
-            pod_id = pod['id']
-            log(f"Pod created: {pod_id}")
+        except Exception as e:
+            log(f"ERROR: {e}")
+            return
+
+        pod_id = pod['id']
+        log(f"Pod created: {pod_id}")
+
+        try:
             log("Waiting for pod to start (this may take a few minutes)...")
-            
             ready_pod = service.wait_for_pod(pod_id)
             log("Pod is RUNNING!")
             
             log("Connecting via SSH to install ComfyUI and Models...")
-            for line in service.execute_setup(ready_pod, self.app.config_data):
+            for line in service.execute_setup(ready_pod, script):
                 log(f"[REMOTE] {line}")
                 
             log("------------------------------------------------")
@@ -206,6 +243,14 @@ class DeployScreen(Screen):
                 
         except Exception as e:
             log(f"ERROR: {e}")
+            # The pod exists and bills whether or not the deploy got anywhere
+            log(f"Terminating pod {pod_id}...")
+            try:
+                service.terminate_pod(pod_id)
+                log(f"Pod {pod_id} terminated.")
+            except Exception as te:
+                log(f"ERROR: {te}")
+                log(f"Pod {pod_id} is STILL RUNNING and billing. Stop it from the RunPod dashboard.")
 
 class ProvisionerApp(App):
     CSS = """
@@ -228,10 +273,13 @@ class ProvisionerApp(App):
         margin-bottom: 1;
     }
     .url_input {
-        width: 40%;
+        width: 30%;
     }
     .name_input {
-        width: 30%;
+        width: 20%;
+    }
+    .sha_input {
+        width: 20%;
     }
     .model_list {
         height: 1fr;